@@ -35,11 +35,13 @@
 import re
 
 implicit_pattern = re.compile(
-    rb"([^:]*):(\d+):(\d+:)? warning: implicit declaration "
-    rb"of function [`']([^']*)'"
+    rb"(?P<implicit_filename>[^:]*):(?P<implicit_linenum>\d+):(\d+:)? "
+    rb"warning: implicit declaration of function "
+    rb"[`'](?P<implicit_func>[^']*)'"
 )
 pointer_pattern = re.compile(
-    rb"([^:]*):(\d+):(\d+:)? warning: "
+    rb"(?P<pointer_filename>[^:]*):(?P<pointer_linenum>\d+):(\d+:)? "
+    rb"warning: "
     rb"("
     rb"(assignment"
     rb"|initialization"
@@ -50,53 +52,16 @@ pointer_pattern = re.compile(
     rb"|"
     rb"cast to pointer from integer of different size)"
 )
+# filter_log matches both of the above in a single pass over each line.
+combined_pattern = re.compile(
+    rb"(?P<implicit>"
+    + implicit_pattern.pattern
+    + rb")|(?P<pointer>"
+    + pointer_pattern.pattern
+    + rb")"
+)
 
-
-def filter_log(in_file, out_file, in_line=False):
-    last_implicit_filename = b""
-    last_implicit_linenum = -1
-    last_implicit_func = b""
-
-    errlist = []
-
-    while True:
-        line = in_file.readline()
-        if in_line:
-            out_file.write(line)
-            out_file.flush()
-        if line == b"":
-            break
-        m = implicit_pattern.match(line)
-        if m:
-            last_implicit_filename = m.group(1)
-            last_implicit_linenum = int(m.group(2))
-            last_implicit_func = m.group(4)
-        else:
-            m = pointer_pattern.match(line)
-            if m:
-                pointer_filename = m.group(1)
-                pointer_linenum = int(m.group(2))
-                if (
-                    last_implicit_filename == pointer_filename
-                    and last_implicit_linenum == pointer_linenum
-                ):
-                    err = (
-                        b"Function `%s' implicitly converted to pointer at "
-                        b"%s:%d"
-                        % (
-                            last_implicit_func,
-                            last_implicit_filename,
-                            last_implicit_linenum,
-                        )
-                    )
-                    errlist.append(err)
-                    out_file.write(err + b"\n")
-
-    if errlist:
-        if in_line:
-            out_file.write(b"\n".join(errlist) + b"\n\n")
-            out_file.write(
-                b"""
+_in_line_explanation = b"""
 
 Our automated build log filter detected the problem(s) above that will
 likely cause your package to segfault on architectures where the size of
@@ -111,5 +76,45 @@ More information can be found at:
 http://wiki.debian.org/ImplicitPointerConversions
 
     """
-            )
+
+
+def filter_log(in_file, out_file, in_line=False):
+    last_implicit_filename = b""
+    last_implicit_linenum = -1
+    last_implicit_func = b""
+
+    errlist = []
+
+    for line in in_file:
+        if in_line:
+            out_file.write(line)
+            out_file.flush()
+        m = combined_pattern.match(line)
+        if m is None:
+            continue
+        if m.lastgroup == "implicit":
+            last_implicit_filename = m.group("implicit_filename")
+            last_implicit_linenum = int(m.group("implicit_linenum"))
+            last_implicit_func = m.group("implicit_func")
+        else:
+            pointer_filename = m.group("pointer_filename")
+            pointer_linenum = int(m.group("pointer_linenum"))
+            if (
+                last_implicit_filename == pointer_filename
+                and last_implicit_linenum == pointer_linenum
+            ):
+                err = (
+                    b"Function `%s' implicitly converted to pointer at "
+                    b"%s:%d"
+                    % (
+                        last_implicit_func,
+                        last_implicit_filename,
+                        last_implicit_linenum,
+                    )
+                )
+                errlist.append(err)
+                out_file.write(err + b"\n")
+
+    if errlist and in_line:
+        out_file.write(b"\n".join(errlist) + b"\n\n" + _in_line_explanation)
     return len(errlist)
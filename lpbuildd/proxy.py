@@ -12,7 +12,11 @@ from twisted.python.compat import intToBytes
 from twisted.web import http, proxy
 from zope.interface import implementer
 
-from lpbuildd.util import RevokeProxyTokenError, revoke_proxy_token
+from lpbuildd.util import (
+    RevokeProxyTokenError,
+    get_proxy_auth_header,
+    revoke_proxy_token,
+)
 
 
 class BuilderProxyClient(proxy.ProxyClient):
@@ -214,6 +218,23 @@ class BuilderProxyFactory(http.HTTPFactory):
 
 
 class BuildManagerProxyMixin:
+    _proxy_url = None
+    _proxy_auth_header = None
+
+    @property
+    def proxy_url(self):
+        return self._proxy_url
+
+    @proxy_url.setter
+    def proxy_url(self, proxy_url):
+        # The credentials embedded in the proxy URL don't change during a
+        # build, so work out the header used to revoke them up front.
+        self._proxy_url = proxy_url
+        if proxy_url:
+            self._proxy_auth_header = get_proxy_auth_header(proxy_url)
+        else:
+            self._proxy_auth_header = None
+
     @property
     def _use_fetch_service(self):
         return hasattr(self, "use_fetch_service") and getattr(
@@ -259,6 +280,7 @@ class BuildManagerProxyMixin:
                 self.proxy_url,
                 self.revocation_endpoint,
                 self._use_fetch_service,
+                auth_header=self._proxy_auth_header,
             )
         except RevokeProxyTokenError as e:
             self._builder.log(f"{e}\n")
@@ -5,6 +5,8 @@ __all__ = [
     "FakeBackend",
     "FakeBuilder",
     "FakeMethod",
+    "RecordingBuildManagerMixin",
+    "SharedFakeBuilderMixin",
     "UncontainedBackend",
 ]
 
@@ -13,9 +15,11 @@ import os
 import shutil
 import stat
 import subprocess
+import tempfile
 from collections import defaultdict
 from configparser import NoOptionError, NoSectionError
 
+from fixtures import EnvironmentVariable
 from twisted.application import service
 
 from lpbuildd.target.backend import Backend
@@ -99,11 +103,28 @@ class FakeConfig:
 class FakeBuilder:
     def __init__(self, tempdir):
         self._cachepath = tempdir
+        self.reset()
+
+    def reset(self):
+        """Forget everything that has happened to this builder.
+
+        This lets tests share a builder (and its file cache directory)
+        rather than constructing a new one each time.
+        """
+        for name in os.listdir(self._cachepath):
+            path = os.path.join(self._cachepath, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
         self._config = FakeConfig()
         self.waitingfiles = {}
-        self.service = service.IServiceCollection(
-            service.Application("FakeBuilder")
-        )
+        # Contents of each waiting file, keyed in the same way as
+        # `waitingfiles`, so that tests needn't read them back from the
+        # cache.
+        self.waitingfilecontents = {}
+        # Few tests need a service collection, so only build one on demand.
+        self._service = None
         for fake_method in (
             "emptyLog",
             "log",
@@ -117,9 +138,22 @@ class FakeBuilder:
         ):
             setattr(self, fake_method, FakeMethod())
 
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = service.IServiceCollection(
+                service.Application("FakeBuilder")
+            )
+        return self._service
+
     def cachePath(self, file):
         return os.path.join(self._cachepath, file)
 
+    def writeBuildLog(self, contents):
+        """Write `contents` (bytes) to the build log, as a build would."""
+        with open(self.cachePath("buildlog"), "wb") as log:
+            log.write(contents)
+
     def addWaitingFile(self, path, name=None):
         if name is None:
             name = os.path.basename(path)
@@ -128,6 +162,7 @@ class FakeBuilder:
         sha1sum = hashlib.sha1(contents).hexdigest()
         shutil.copy(path, self.cachePath(sha1sum))
         self.waitingfiles[name] = sha1sum
+        self.waitingfilecontents[name] = contents
 
     def anyMethod(self, *args, **kwargs):
         pass
@@ -139,6 +174,56 @@ class FakeBuilder:
         return "i386"
 
 
+class RecordingBuildManagerMixin:
+    """Record the subprocesses a build manager runs, without running them.
+
+    Mix this into a `BuildManager` subclass ahead of the manager class.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = []
+        self.iterators = []
+
+    def runSubProcess(self, path, command, iterate=None, env=None):
+        self.commands.append([path] + command)
+        if iterate is None:
+            iterate = self.iterate
+        self.iterators.append(iterate)
+        return 0
+
+
+class SharedFakeBuilderMixin:
+    """Share a temporary directory and `FakeBuilder` across a test class.
+
+    Mix this into a `TestCase` subclass ahead of `TestCase`.  Each test gets
+    its own `working_dir` containing a `home_dir`, which `$HOME` points to,
+    and starts with a freshly reset builder.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Prefer a memory-backed filesystem if there is one.
+        cls.root_dir = tempfile.mkdtemp(
+            dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+        )
+        cls.addClassCleanup(shutil.rmtree, cls.root_dir)
+        # Tests share the builder's file cache directory; resetting the
+        # builder empties it along with the rest of the builder's state.
+        cls.builder_dir = os.path.join(cls.root_dir, "builder")
+        os.mkdir(cls.builder_dir)
+        cls.builder = FakeBuilder(cls.builder_dir)
+
+    def setUp(self):
+        super().setUp()
+        self.working_dir = tempfile.mkdtemp(dir=self.root_dir)
+        self.home_dir = os.path.join(self.working_dir, "home")
+        os.mkdir(self.home_dir)
+        self.useFixture(EnvironmentVariable("HOME", self.home_dir))
+        self.builder.reset()
+
+
 class FakeBackend(Backend):
     supports_snapd = True
 
@@ -170,6 +255,11 @@ class FakeBackend(Backend):
     def add_file(self, path, contents, mode=0o644):
         self._add_inode(path, contents, stat.S_IFREG | mode)
 
+    def add_files(self, files, mode=0o644):
+        """Add several files at once, given a dict of paths to contents."""
+        for path, contents in files.items():
+            self._add_inode(path, contents, stat.S_IFREG | mode)
+
     def add_link(self, path, target):
         self._add_inode(path, target, stat.S_IFLNK | 0o777)
 
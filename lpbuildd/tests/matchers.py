@@ -17,9 +17,38 @@ class HasWaitingFiles(Matcher):
         )
 
     def match(self, builder):
-        waiting_file_contents = {}
-        for name in builder.waitingfiles:
-            cache_path = builder.cachePath(builder.waitingfiles[name])
-            with open(cache_path, "rb") as f:
-                waiting_file_contents[name] = f.read()
-        return MatchesDict(self.files).match(waiting_file_contents)
+        return MatchesDict(self.files).match(builder.waitingfilecontents)
+
+
+# The start of every command run via `BuildManager.runTargetSubProcess`,
+# given the `FakeConfig` used in tests.
+IN_TARGET_PREFIX = ("sharepath/bin/in-target", "in-target")
+
+
+class CommandMatches(Matcher):
+    """Match an `in-target` command recorded by a mock build manager."""
+
+    def __init__(
+        self,
+        action,
+        buildid,
+        args=(),
+        backend="lxd",
+        series="xenial",
+        arch="i386",
+    ):
+        self.expected = [
+            *IN_TARGET_PREFIX,
+            action,
+            "--backend=%s" % backend,
+            "--series=%s" % series,
+            "--arch=%s" % arch,
+            buildid,
+        ]
+        self.expected.extend(args)
+
+    def __str__(self):
+        return "CommandMatches(%r)" % (self.expected,)
+
+    def match(self, command):
+        return Equals(self.expected).match(command)
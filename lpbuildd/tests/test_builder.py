@@ -8,6 +8,7 @@ Most tests are done on subclasses instead.
 
 import io
 import re
+from types import SimpleNamespace
 
 from fixtures import TempDir
 from testtools import TestCase
@@ -16,7 +17,7 @@ from twisted.internet import defer
 from twisted.logger import FileLogObserver, formatEvent, globalLogPublisher
 
 from lpbuildd.builder import Builder, BuildManager, _sanitizeURLs
-from lpbuildd.tests.fakebuilder import FakeConfig
+from lpbuildd.tests.fakebuilder import FakeConfig, FakeMethod
 
 
 class TestSanitizeURLs(TestCase):
@@ -97,6 +98,24 @@ class TestBuildManager(TestCase):
             self.log_file.getvalue(),
         )
 
+    def test_runSubProcess_allows_posix_spawn(self):
+        # runSubProcess doesn't ask for anything that would stop Twisted
+        # from using posix_spawnp rather than forking: no PTY, no change
+        # of user or group, and the working directory is the home
+        # directory.
+        config = FakeConfig()
+        config.set("builder", "filecache", self.useFixture(TempDir()).path)
+        builder = Builder(config)
+        builder._log = io.BytesIO()
+        reactor = SimpleNamespace(spawnProcess=FakeMethod())
+        manager = BuildManager(builder, "123", reactor=reactor)
+        manager.runSubProcess("echo", ["echo", "hello world"])
+        self.assertEqual(1, reactor.spawnProcess.call_count)
+        [kwargs] = reactor.spawnProcess.extract_kwargs()
+        self.assertEqual(manager.home, kwargs["path"])
+        for key in ("usePTY", "uid", "gid"):
+            self.assertNotIn(key, kwargs)
+
     @defer.inlineCallbacks
     def test_runSubProcess_bytes(self):
         config = FakeConfig()
@@ -11,6 +11,7 @@ from testtools import TestCase
 from testtools.matchers import MatchesRegex
 
 from lpbuildd.check_implicit_pointer_functions import (
+    combined_pattern,
     filter_log,
     implicit_pattern,
     pointer_pattern,
@@ -54,6 +55,24 @@ class TestPointerCheckRegexes(TestCase):
         )
         self.assertIsNot(None, implicit_pattern.match(line))
 
+    def test_combined_pattern_distinguishes_warnings(self):
+        # The combined regex reports which kind of warning it matched.
+        implicit_line = (
+            b"/build/gtk/ubuntumenuproxymodule.c:94: "
+            b"warning: implicit declaration of function 'foo'"
+        )
+        pointer_line = (
+            b"/build/gtk/ubuntumenuproxymodule.c:94: "
+            b"warning: assignment makes pointer from integer without a cast"
+        )
+        self.assertEqual(
+            "implicit", combined_pattern.match(implicit_line).lastgroup
+        )
+        self.assertEqual(
+            "pointer", combined_pattern.match(pointer_line).lastgroup
+        )
+        self.assertIsNone(combined_pattern.match(b"Innocuous build log"))
+
 
 class TestFilterLog(TestCase):
     def test_out_of_line_no_errors(self):
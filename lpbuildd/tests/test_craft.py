@@ -6,22 +6,12 @@ from testtools.twistedsupport import AsynchronousDeferredRunTest
 from twisted.internet import defer
 
 from lpbuildd.craft import CraftBuildManager, CraftBuildState
-from lpbuildd.tests.fakebuilder import FakeBuilder
+from lpbuildd.tests.fakebuilder import FakeBuilder, RecordingBuildManagerMixin
 from lpbuildd.tests.matchers import HasWaitingFiles
 
 
-class MockBuildManager(CraftBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
-
-    def runSubProcess(self, path, command, iterate=None, env=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
+class MockBuildManager(RecordingBuildManagerMixin, CraftBuildManager):
+    pass
 
 
 class TestCraftBuildManagerIteration(TestCase):
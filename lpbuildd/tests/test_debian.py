@@ -3,14 +3,23 @@
 
 import base64
 import os.path
-import shutil
-import tempfile
 
 from testtools import TestCase
 from twisted.internet.task import Clock
 
 from lpbuildd.debian import DebianBuildManager, DebianBuildState
-from lpbuildd.tests.fakebuilder import FakeBuilder
+from lpbuildd.tests.fakebuilder import SharedFakeBuilderMixin
+from lpbuildd.tests.matchers import IN_TARGET_PREFIX
+
+ARCHIVE = "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial main"
+# Arguments for a build with an archive.  initiate() does not modify its
+# arguments, so tests may pass this directly.
+BASE_EXTRA_ARGS = {
+    "arch_tag": "amd64",
+    "archives": [ARCHIVE],
+    "series": "xenial",
+}
+TRUSTED_KEY = base64.b64encode(b"key material")
 
 
 class MockBuildState(DebianBuildState):
@@ -48,33 +57,50 @@ class MockBuildManager(DebianBuildManager):
         self.doUnmounting()
 
 
-class TestDebianBuildManagerIteration(TestCase):
+class TestDebianBuildManagerIteration(SharedFakeBuilderMixin, TestCase):
     """Run a generic DebianBuildManager through its iteration steps."""
 
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The build manager unpacks its chroot from the builder's cache.
+        cls.chroot_tarball = os.path.join(cls.builder_dir, "chroot.tar.gz")
+
     def setUp(self):
         super().setUp()
-        self.working_dir = tempfile.mkdtemp()
-        self.addCleanup(lambda: shutil.rmtree(self.working_dir))
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.clock = Clock()
         self.buildmanager = MockBuildManager(
             self.builder, self.buildid, reactor=self.clock
         )
-        self.buildmanager.home = home_dir
+        self.buildmanager.home = self.home_dir
         self.buildmanager._cachepath = self.builder._cachepath
-        self.chrootdir = os.path.join(
-            home_dir, "build-%s" % self.buildid, "chroot-autobuild"
-        )
 
     def getState(self):
         """Retrieve build manager's state."""
         return self.buildmanager._state
 
+    def expectedCommand(
+        self, subcommand, *args, backend="chroot", constraints=(), stdin=None
+    ):
+        """Return the expected record of an in-target command."""
+        return (
+            [
+                *IN_TARGET_PREFIX,
+                subcommand,
+                "--backend=%s" % backend,
+                "--series=xenial",
+                "--arch=amd64",
+                *(
+                    "--constraint=%s" % constraint
+                    for constraint in constraints
+                ),
+                self.buildid,
+                *args,
+            ],
+            stdin,
+        )
+
     def test_no_constraints(self):
         # If no `builder_constraints` argument is passed, the backend is set
         # up with no constraints.
@@ -95,190 +121,111 @@ class TestDebianBuildManagerIteration(TestCase):
         # The build manager's iterate() kicks off the consecutive states
         # after INIT.
         self.buildmanager.initiate({}, "chroot.tar.gz", extra_args)
-        self.assertEqual(DebianBuildState.INIT, self.getState())
-        self.assertEqual(
+        self.assertLastStep(
+            DebianBuildState.INIT,
             (["sharepath/bin/builder-prep", "builder-prep"], None),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
 
-    def test_iterate(self):
-        # The build manager iterates a normal build from start to finish.
-        extra_args = {
-            "arch_tag": "amd64",
-            "archives": [
-                "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial main",
-            ],
-            "series": "xenial",
-        }
-        self.startBuild(extra_args)
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
+    def assertLastCommand(self, command):
+        """Assert that the last command run matches an expected record."""
+        argv, stdin = command
+        last_argv, last_stdin = self.buildmanager.commands[-1]
+        self.assertEqual(stdin, last_stdin)
+        self.assertEqual(argv, last_argv)
+
+    def assertLastStep(self, state, command, default_iterator=True):
+        """Assert the build manager's state and the last command it ran.
+
+        If `default_iterator` is true, also check that the command will
+        continue with the usual iterator; otherwise check that it will not.
+        """
+        self.assertEqual(state, self.getState())
+        self.assertLastCommand(command)
+        if default_iterator:
+            self.assertEqual(
+                self.buildmanager.iterate, self.buildmanager.iterators[-1]
+            )
+        else:
+            self.assertNotEqual(
+                self.buildmanager.iterate, self.buildmanager.iterators[-1]
+            )
+
+    def iterateSteps(self, steps):
+        """Iterate the build manager through a sequence of expected steps.
+
+        The whole sequence is run first, and then the states passed
+        through and the commands run are each compared in one go.
+
+        :param steps: A list of (state, command) pairs, as accepted by
+            `assertLastStep`.
+        """
+        count = len(steps)
+        states = []
+        for _ in steps:
+            self.buildmanager.iterate(0)
+            states.append(self.getState())
+        expected_states, expected_commands = zip(*steps)
+        self.assertEqual(list(expected_states), states)
+        self.assertEqual(
+            list(expected_commands), self.buildmanager.commands[-count:]
+        )
+        self.assertEqual(
+            [self.buildmanager.iterate] * count,
+            self.buildmanager.iterators[-count:],
+        )
+
+    def expectedPreparationSteps(self, trusted_keys=False):
+        """Return the steps from unpacking the chroot up to the build."""
+        steps = [
             (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
+                DebianBuildState.UNPACK,
+                self.expectedCommand(
                     "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
                     "--image-type",
                     "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
+                    self.chroot_tarball,
+                ),
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.MOUNT, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "mount-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.SOURCES, self.getState())
-        self.assertEqual(
+            (DebianBuildState.MOUNT, self.expectedCommand("mount-chroot")),
             (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
+                DebianBuildState.SOURCES,
+                self.expectedCommand(
                     "override-sources-list",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial "
-                    "main",
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UPDATE, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "update-debian-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
+                    ARCHIVE,
+                ),
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (["/bin/true", "true"], None), self.buildmanager.commands[-1]
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
+        ]
+        if trusted_keys:
+            steps.append(
+                (
+                    DebianBuildState.KEYS,
+                    self.expectedCommand(
+                        "add-trusted-keys", stdin=b"key material"
+                    ),
+                )
+            )
+        steps.extend(
+            [
+                (
+                    DebianBuildState.UPDATE,
+                    self.expectedCommand("update-debian-chroot"),
+                ),
+                (MockBuildState.MAIN, (["/bin/true", "true"], None)),
+            ]
+        )
+        return steps
+
+    def reapBuild(self):
+        # After the build, the build manager reaps processes.
         self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "scan-for-processes",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+        self.assertLastStep(
+            MockBuildState.MAIN,
+            self.expectedCommand("scan-for-processes"),
+            default_iterator=False,
         )
-
         self.buildmanager.iterateReap(self.getState(), 0)
-        self.assertEqual(DebianBuildState.UMOUNT, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "umount-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.CLEANUP, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "remove-build",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
 
-        self.buildmanager.iterate(0)
+    def assertBuildSucceeded(self):
         self.assertFalse(self.builder.wasCalled("builderFail"))
         self.assertFalse(self.builder.wasCalled("chrootFail"))
         self.assertFalse(self.builder.wasCalled("buildFail"))
@@ -286,396 +233,67 @@ class TestDebianBuildManagerIteration(TestCase):
         self.assertTrue(self.builder.wasCalled("buildOK"))
         self.assertTrue(self.builder.wasCalled("buildComplete"))
 
-    def test_iterate_trusted_keys(self):
-        # The build manager iterates a build with trusted keys from start to
-        # finish.
-        extra_args = {
-            "arch_tag": "amd64",
-            "archives": [
-                "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial main",
-            ],
-            "series": "xenial",
-            "trusted_keys": [base64.b64encode(b"key material")],
-        }
-        self.startBuild(extra_args)
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--image-type",
-                    "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.MOUNT, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "mount-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.SOURCES, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "override-sources-list",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial "
-                    "main",
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.KEYS, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "add-trusted-keys",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                b"key material",
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UPDATE, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "update-debian-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
+    def test_iterate(self):
+        # The build manager iterates a normal build from start to finish.
+        self.startBuild(BASE_EXTRA_ARGS)
+        self.iterateSteps(self.expectedPreparationSteps())
+        self.reapBuild()
+        self.assertLastStep(
+            DebianBuildState.UMOUNT, self.expectedCommand("umount-chroot")
         )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+        self.iterateSteps(
+            [(DebianBuildState.CLEANUP, self.expectedCommand("remove-build"))]
         )
-
         self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (["/bin/true", "true"], None), self.buildmanager.commands[-1]
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
+        self.assertBuildSucceeded()
 
-        self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "scan-for-processes",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterateReap(self.getState(), 0)
-        self.assertEqual(DebianBuildState.UMOUNT, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "umount-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.CLEANUP, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "remove-build",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
+    def test_iterate_trusted_keys(self):
+        # The build manager iterates a build with trusted keys from start to
+        # finish.
+        extra_args = {**BASE_EXTRA_ARGS, "trusted_keys": [TRUSTED_KEY]}
+        self.startBuild(extra_args)
+        self.iterateSteps(self.expectedPreparationSteps(trusted_keys=True))
+        self.reapBuild()
+        self.assertLastStep(
+            DebianBuildState.UMOUNT, self.expectedCommand("umount-chroot")
         )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+        self.iterateSteps(
+            [(DebianBuildState.CLEANUP, self.expectedCommand("remove-build"))]
         )
-
         self.buildmanager.iterate(0)
-        self.assertFalse(self.builder.wasCalled("builderFail"))
-        self.assertFalse(self.builder.wasCalled("chrootFail"))
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertFalse(self.builder.wasCalled("depFail"))
-        self.assertTrue(self.builder.wasCalled("buildOK"))
-        self.assertTrue(self.builder.wasCalled("buildComplete"))
+        self.assertBuildSucceeded()
 
     def test_iterate_fast_cleanup(self):
         # The build manager can be told that it doesn't need to do the final
         # cleanup steps, because the VM is about to be torn down anyway.  It
         # iterates such a build from start to finish, but without calling
         # umount-chroot or remove-build.
-        extra_args = {
-            "arch_tag": "amd64",
-            "archives": [
-                "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial main",
-            ],
-            "fast_cleanup": True,
-            "series": "xenial",
-        }
+        extra_args = {**BASE_EXTRA_ARGS, "fast_cleanup": True}
         self.startBuild(extra_args)
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--image-type",
-                    "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.MOUNT, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "mount-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.SOURCES, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "override-sources-list",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial "
-                    "main",
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UPDATE, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "update-debian-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (["/bin/true", "true"], None), self.buildmanager.commands[-1]
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterate(0)
-        self.assertEqual(MockBuildState.MAIN, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "scan-for-processes",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                ],
-                None,
-            ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-
-        self.buildmanager.iterateReap(self.getState(), 0)
-        self.assertFalse(self.builder.wasCalled("builderFail"))
-        self.assertFalse(self.builder.wasCalled("chrootFail"))
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertFalse(self.builder.wasCalled("depFail"))
-        self.assertTrue(self.builder.wasCalled("buildOK"))
-        self.assertTrue(self.builder.wasCalled("buildComplete"))
+        self.iterateSteps(self.expectedPreparationSteps())
+        self.reapBuild()
+        self.assertBuildSucceeded()
 
     def test_iterate_apt_proxy(self):
         # The build manager can be configured to use an APT proxy.
         self.builder._config.set(
             "proxy", "apt", "http://apt-proxy.example:3128/"
         )
-        extra_args = {
-            "arch_tag": "amd64",
-            "archives": [
-                "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial main",
-            ],
-            "series": "xenial",
-        }
-        self.startBuild(extra_args)
+        self.startBuild(BASE_EXTRA_ARGS)
 
         self.buildmanager.iterate(0)
         self.assertEqual(DebianBuildState.UNPACK, self.getState())
         self.buildmanager.iterate(0)
         self.assertEqual(DebianBuildState.MOUNT, self.getState())
         self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.SOURCES, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "override-sources-list",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--apt-proxy-url",
-                    "http://apt-proxy.example:3128/",
-                    "deb http://ppa.launchpad.dev/owner/name/ubuntu xenial "
-                    "main",
-                ],
-                None,
+        self.assertLastStep(
+            DebianBuildState.SOURCES,
+            self.expectedCommand(
+                "override-sources-list",
+                "--apt-proxy-url",
+                "http://apt-proxy.example:3128/",
+                ARCHIVE,
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
 
     def test_iterate_lxd(self):
@@ -690,29 +308,15 @@ class TestDebianBuildManagerIteration(TestCase):
         self.startBuild(extra_args)
 
         self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=lxd",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--image-type",
-                    "lxd",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
+        self.assertLastStep(
+            DebianBuildState.UNPACK,
+            self.expectedCommand(
+                "unpack-chroot",
+                "--image-type",
+                "lxd",
+                self.chroot_tarball,
+                backend="lxd",
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
 
     def test_iterate_no_constraints(self):
@@ -725,29 +329,14 @@ class TestDebianBuildManagerIteration(TestCase):
         self.startBuild(extra_args)
 
         self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--image-type",
-                    "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
+        self.assertLastStep(
+            DebianBuildState.UNPACK,
+            self.expectedCommand(
+                "unpack-chroot",
+                "--image-type",
+                "chroot",
+                self.chroot_tarball,
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
 
     def test_iterate_constraints_None(self):
@@ -761,29 +350,14 @@ class TestDebianBuildManagerIteration(TestCase):
         self.startBuild(extra_args)
 
         self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    self.buildid,
-                    "--image-type",
-                    "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
+        self.assertLastStep(
+            DebianBuildState.UNPACK,
+            self.expectedCommand(
+                "unpack-chroot",
+                "--image-type",
+                "chroot",
+                self.chroot_tarball,
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
 
     def test_iterate_constraints(self):
@@ -797,29 +371,13 @@ class TestDebianBuildManagerIteration(TestCase):
         self.startBuild(extra_args)
 
         self.buildmanager.iterate(0)
-        self.assertEqual(DebianBuildState.UNPACK, self.getState())
-        self.assertEqual(
-            (
-                [
-                    "sharepath/bin/in-target",
-                    "in-target",
-                    "unpack-chroot",
-                    "--backend=chroot",
-                    "--series=xenial",
-                    "--arch=amd64",
-                    "--constraint=gpu",
-                    "--constraint=large",
-                    self.buildid,
-                    "--image-type",
-                    "chroot",
-                    os.path.join(
-                        self.buildmanager._cachepath, "chroot.tar.gz"
-                    ),
-                ],
-                None,
+        self.assertLastStep(
+            DebianBuildState.UNPACK,
+            self.expectedCommand(
+                "unpack-chroot",
+                "--image-type",
+                "chroot",
+                self.chroot_tarball,
+                constraints=["gpu", "large"],
             ),
-            self.buildmanager.commands[-1],
-        )
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
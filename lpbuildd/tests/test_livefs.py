@@ -1,9 +1,7 @@
 # Copyright 2013-2019 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
-import os
 
-from fixtures import EnvironmentVariable, TempDir
 from testtools import TestCase
 from testtools.twistedsupport import AsynchronousDeferredRunTest
 from twisted.internet import defer
@@ -12,38 +10,26 @@ from lpbuildd.livefs import (
     LiveFilesystemBuildManager,
     LiveFilesystemBuildState,
 )
-from lpbuildd.tests.fakebuilder import FakeBuilder
-from lpbuildd.tests.matchers import HasWaitingFiles
-
+from lpbuildd.tests.fakebuilder import (
+    RecordingBuildManagerMixin,
+    SharedFakeBuilderMixin,
+)
+from lpbuildd.tests.matchers import CommandMatches
 
-class MockBuildManager(LiveFilesystemBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
 
-    def runSubProcess(self, path, command, iterate=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
+class MockBuildManager(RecordingBuildManagerMixin, LiveFilesystemBuildManager):
+    pass
 
 
-class TestLiveFilesystemBuildManagerIteration(TestCase):
+class TestLiveFilesystemBuildManagerIteration(
+    SharedFakeBuilderMixin, TestCase
+):
     """Run LiveFilesystemBuildManager through its iteration steps."""
 
     run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=5)
 
     def setUp(self):
         super().setUp()
-        self.working_dir = self.useFixture(TempDir()).path
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.useFixture(EnvironmentVariable("HOME", home_dir))
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.buildmanager = MockBuildManager(self.builder, self.buildid)
         self.buildmanager._cachepath = self.builder._cachepath
@@ -78,20 +64,15 @@ class TestLiveFilesystemBuildManagerIteration(TestCase):
         self.assertEqual(
             LiveFilesystemBuildState.BUILD_LIVEFS, self.getState()
         )
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "buildlivefs",
-            "--backend=lxd",
-            "--series=saucy",
-            "--arch=i386",
-            self.buildid,
-            "--project",
-            "ubuntu",
-        ]
-        if options is not None:
-            expected_command.extend(options)
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "buildlivefs",
+                self.buildid,
+                ["--project", "ubuntu", *(options or [])],
+                series="saucy",
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -102,9 +83,7 @@ class TestLiveFilesystemBuildManagerIteration(TestCase):
         # The build manager iterates a normal build from start to finish.
         yield self.startBuild()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+        self.builder.writeBuildLog(b"I am a build log.")
 
         self.buildmanager.backend.add_file(
             "/build/livecd.ubuntu.manifest", b"I am a manifest file."
@@ -112,45 +91,31 @@ class TestLiveFilesystemBuildManagerIteration(TestCase):
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=saucy",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(
             LiveFilesystemBuildState.BUILD_LIVEFS, self.getState()
         )
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("scan-for-processes", self.buildid, series="saucy"),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
         self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "livecd.ubuntu.manifest": b"I am a manifest file.",
-                }
-            ),
+        self.assertEqual(
+            {
+                "livecd.ubuntu.manifest": b"I am a manifest file.",
+            },
+            self.builder.waitingfilecontents,
         )
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=saucy",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(LiveFilesystemBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("umount-chroot", self.buildid, series="saucy"),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -202,9 +167,7 @@ class TestLiveFilesystemBuildManagerIteration(TestCase):
         # Symlinks in the build output are not included in gathered results.
         yield self.startBuild()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+        self.builder.writeBuildLog(b"I am a build log.")
 
         self.buildmanager.backend.add_file(
             "/build/livecd.ubuntu.kernel-generic", b"I am a kernel."
@@ -214,11 +177,9 @@ class TestLiveFilesystemBuildManagerIteration(TestCase):
         )
 
         yield self.buildmanager.iterate(0)
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "livecd.ubuntu.kernel-generic": b"I am a kernel.",
-                }
-            ),
+        self.assertEqual(
+            {
+                "livecd.ubuntu.kernel-generic": b"I am a kernel.",
+            },
+            self.builder.waitingfilecontents,
         )
@@ -2,32 +2,25 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 import json
-import os
 from collections import OrderedDict
 
-from fixtures import EnvironmentVariable, MockPatch, TempDir
+from fixtures import MockPatch
 from testtools import TestCase
 from testtools.matchers import Contains
 from testtools.twistedsupport import AsynchronousDeferredRunTest
 from twisted.internet import defer
 
 from lpbuildd.oci import OCIBuildManager, OCIBuildState
-from lpbuildd.tests.fakebuilder import FakeBuilder
+from lpbuildd.tests.fakebuilder import (
+    RecordingBuildManagerMixin,
+    SharedFakeBuilderMixin,
+)
+from lpbuildd.tests.matchers import CommandMatches
 from lpbuildd.tests.oci_tarball import OCITarball
 
 
-class MockBuildManager(OCIBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
-
-    def runSubProcess(self, path, command, iterate=None, env=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
+class MockBuildManager(RecordingBuildManagerMixin, OCIBuildManager):
+    pass
 
 
 class MockOCITarSave:
@@ -37,20 +30,13 @@ class MockOCITarSave:
         return open(tar_path, "rb")
 
 
-class TestOCIBuildManagerIteration(TestCase):
+class TestOCIBuildManagerIteration(SharedFakeBuilderMixin, TestCase):
     """Run OCIBuildManager through its iteration steps."""
 
     run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=5)
 
     def setUp(self):
         super().setUp()
-        self.working_dir = self.useFixture(TempDir()).path
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.useFixture(EnvironmentVariable("HOME", home_dir))
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.buildmanager = MockBuildManager(self.builder, self.buildid)
         self.buildmanager._cachepath = self.builder._cachepath
@@ -82,24 +68,22 @@ class TestOCIBuildManagerIteration(TestCase):
         # BUILD_OCI: Run the builder's payload to build the OCI image.
         yield self.buildmanager.iterate(0)
         self.assertEqual(OCIBuildState.BUILD_OCI, self.getState())
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "build-oci",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        if options is not None:
-            expected_command.extend(options)
-        expected_command.append("test-image")
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "build-oci", self.buildid, [*(options or []), "test-image"]
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
         self.assertFalse(self.builder.wasCalled("chrootFail"))
 
+    def seedBuildOutput(self):
+        """Leave behind the build log and image that a build would."""
+        self.builder.writeBuildLog(b"I am a build log.")
+        self.buildmanager.backend.run.result = MockOCITarSave()
+
     @defer.inlineCallbacks
     def test_iterate(self):
         # This sha would change as it includes file attributes in the
@@ -120,89 +104,7 @@ class TestOCIBuildManagerIteration(TestCase):
             "master",
         ]
         yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.run.result = MockOCITarSave()
-
-        self.buildmanager.backend.add_file(
-            "/var/lib/docker/image/"
-            "vfs/distribution/v2metadata-by-diffid/sha256/diff1",
-            b"""[{"Digest": "test_digest", "SourceRepository": "test"}]""",
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(OCIBuildState.BUILD_OCI, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        expected_files = [
-            "manifest.json",
-            "layer-1.tar.gz",
-            "layer-2.tar.gz",
-            "layer-3.tar.gz",
-            "digests.json",
-            "config.json",
-        ]
-        for expected in expected_files:
-            self.assertThat(self.builder.waitingfiles, Contains(expected))
-
-        cache_path = self.builder.cachePath(
-            self.builder.waitingfiles["digests.json"]
-        )
-        with open(cache_path) as f:
-            digests_contents = f.read()
-        digests_expected = [
-            {
-                "sha256:diff1": {
-                    "source": "test",
-                    "digest": "test_digest",
-                    "layer_id": "layer-1",
-                },
-                "sha256:diff2": {
-                    "source": "",
-                    "digest": "testsha",
-                    "layer_id": "layer-2",
-                },
-                "sha256:diff3": {
-                    "source": "",
-                    "digest": "testsha",
-                    "layer_id": "layer-3",
-                },
-            }
-        ]
-        self.assertEqual(digests_expected, json.loads(digests_contents))
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(OCIBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
+        yield self.assertBuildCompletes()
 
     @defer.inlineCallbacks
     def test_iterate_with_file_and_args(self):
@@ -213,7 +115,7 @@ class TestOCIBuildManagerIteration(TestCase):
         )
         sha_mock.mock.return_value = "testsha"
         # The build manager iterates a build that specifies a non-default
-        # Dockerfile location from start to finish.
+        # Dockerfile location and build arguments from start to finish.
         args = {
             "git_repository": "https://git.launchpad.dev/~example/+git/snap",
             "git_path": "master",
@@ -233,13 +135,12 @@ class TestOCIBuildManagerIteration(TestCase):
             "VAR2=yyy zzz",
         ]
         yield self.startBuild(args, expected_options)
+        yield self.assertBuildCompletes()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.run.result = MockOCITarSave()
-
+    @defer.inlineCallbacks
+    def assertBuildCompletes(self):
+        """Iterate a started build through to the UMOUNT state."""
+        self.seedBuildOutput()
         self.buildmanager.backend.add_file(
             "/var/lib/docker/image/"
             "vfs/distribution/v2metadata-by-diffid/sha256/diff1",
@@ -248,17 +149,11 @@ class TestOCIBuildManagerIteration(TestCase):
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(OCIBuildState.BUILD_OCI, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("scan-for-processes", self.buildid),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -302,17 +197,11 @@ class TestOCIBuildManagerIteration(TestCase):
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(OCIBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("umount-chroot", self.buildid),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -340,11 +229,7 @@ class TestOCIBuildManagerIteration(TestCase):
         ]
         yield self.startBuild(args, expected_options)
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.run.result = MockOCITarSave()
+        self.seedBuildOutput()
         yield self.buildmanager.iterate(0)
         self.assertFalse(self.builder.wasCalled("buildFail"))
 
@@ -1,43 +1,28 @@
 import os
 
-from fixtures import EnvironmentVariable, TempDir
 from testtools import TestCase
 from testtools.twistedsupport import AsynchronousDeferredRunTest
 from twisted.internet import defer
 
 from lpbuildd.rock import RockBuildManager, RockBuildState
-from lpbuildd.tests.fakebuilder import FakeBuilder
-from lpbuildd.tests.matchers import HasWaitingFiles
+from lpbuildd.tests.fakebuilder import (
+    RecordingBuildManagerMixin,
+    SharedFakeBuilderMixin,
+)
+from lpbuildd.tests.matchers import CommandMatches
 
 
-class MockBuildManager(RockBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
+class MockBuildManager(RecordingBuildManagerMixin, RockBuildManager):
+    pass
 
-    def runSubProcess(self, path, command, iterate=None, env=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
 
-
-class TestRockBuildManagerIteration(TestCase):
+class TestRockBuildManagerIteration(SharedFakeBuilderMixin, TestCase):
     """Run RockBuildManager through its iteration steps."""
 
     run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=5)
 
     def setUp(self):
         super().setUp()
-        self.working_dir = self.useFixture(TempDir()).path
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.useFixture(EnvironmentVariable("HOME", home_dir))
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.buildmanager = MockBuildManager(self.builder, self.buildid)
         self.buildmanager._cachepath = self.builder._cachepath
@@ -69,19 +54,12 @@ class TestRockBuildManagerIteration(TestCase):
         # BUILD_ROCK: Run the builder's payload to build the rock.
         yield self.buildmanager.iterate(0)
         self.assertEqual(RockBuildState.BUILD_ROCK, self.getState())
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "build-rock",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        if options is not None:
-            expected_command.extend(options)
-        expected_command.append("test-rock")
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "build-rock", self.buildid, [*(options or []), "test-rock"]
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -113,9 +91,7 @@ class TestRockBuildManagerIteration(TestCase):
         ]
         yield self.startBuild(args, expected_options)
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+        self.builder.writeBuildLog(b"I am a build log.")
 
         self.buildmanager.backend.add_file(
             "/home/buildd/test-rock/test-rock_0_all.rock", b"I am rocking."
@@ -123,44 +99,29 @@ class TestRockBuildManagerIteration(TestCase):
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-
         self.assertEqual(RockBuildState.BUILD_ROCK, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("scan-for-processes", self.buildid),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
         self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-rock_0_all.rock": b"I am rocking.",
-                }
-            ),
+        self.assertEqual(
+            {
+                "test-rock_0_all.rock": b"I am rocking.",
+            },
+            self.builder.waitingfilecontents,
         )
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(RockBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("umount-chroot", self.buildid),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -185,9 +146,7 @@ class TestRockBuildManagerIteration(TestCase):
         ]
         yield self.startBuild(args, expected_options)
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+        self.builder.writeBuildLog(b"I am a build log.")
 
         self.buildmanager.backend.add_file(
             "/home/buildd/test-rock/rock/test-rock_0_all.rock",
@@ -196,44 +155,29 @@ class TestRockBuildManagerIteration(TestCase):
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-
         self.assertEqual(RockBuildState.BUILD_ROCK, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("scan-for-processes", self.buildid),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
         self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-rock_0_all.rock": b"I am rocking.",
-                }
-            ),
+        self.assertEqual(
+            {
+                "test-rock_0_all.rock": b"I am rocking.",
+            },
+            self.builder.waitingfilecontents,
         )
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(RockBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches("umount-chroot", self.buildid),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
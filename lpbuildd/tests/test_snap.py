@@ -5,47 +5,65 @@ import base64
 import os
 
 import responses
-from fixtures import EnvironmentVariable, TempDir
-from testtools import TestCase
-from testtools.content import text_content
-from testtools.twistedsupport import AsynchronousDeferredRunTest
-from twisted.internet import defer, reactor, utils
+from testtools import TestCase, run_test_with
+from testtools.matchers import Is
+from testtools.twistedsupport import AsynchronousDeferredRunTest, succeeded
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint
 from twisted.web import http, proxy, resource, server, static
+from twisted.web.client import ProxyAgent, readBody
 
 from lpbuildd.proxy import BuilderProxyFactory
 from lpbuildd.snap import SnapBuildManager, SnapBuildState
-from lpbuildd.tests.fakebuilder import FakeBuilder
-from lpbuildd.tests.matchers import HasWaitingFiles
-
-
-class MockBuildManager(SnapBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
-
-    def runSubProcess(self, path, command, iterate=None, env=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
-
-
-class TestSnapBuildManagerIteration(TestCase):
+from lpbuildd.tests.fakebuilder import (
+    RecordingBuildManagerMixin,
+    SharedFakeBuilderMixin,
+)
+from lpbuildd.tests.matchers import CommandMatches, HasWaitingFiles
+
+run_with_reactor = run_test_with(
+    AsynchronousDeferredRunTest.make_factory(timeout=5)
+)
+
+GIT_ARGS = {
+    "git_repository": "https://git.launchpad.dev/~example/+git/snap",
+    "git_path": "master",
+}
+GIT_OPTIONS = [
+    "--git-repository",
+    "https://git.launchpad.dev/~example/+git/snap",
+    "--git-path",
+    "master",
+]
+
+# Channels to install snaps from, in the order that buildsnap is expected
+# to be given them.
+CHANNELS = (
+    ("core", "candidate"),
+    ("core18", "beta"),
+    ("snapcraft", "edge"),
+)
+
+SNAP_PACKAGE_FILE = {
+    "/build/test-snap/test-snap_0_all.snap": b"I am a snap package.",
+}
+
+# Files served by the fake remote endpoint in test_fetch_via_proxy.
+REMOTE_PAYLOADS = {
+    "x": b"x" * 1024,
+    "y": b"y" * 65536,
+}
+
+
+class MockBuildManager(RecordingBuildManagerMixin, SnapBuildManager):
+    pass
+
+
+class TestSnapBuildManagerIteration(SharedFakeBuilderMixin, TestCase):
     """Run SnapBuildManager through its iteration steps."""
 
-    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=5)
-
     def setUp(self):
         super().setUp()
-        self.working_dir = self.useFixture(TempDir()).path
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.useFixture(EnvironmentVariable("HOME", home_dir))
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.buildmanager = MockBuildManager(self.builder, self.buildid)
         self.buildmanager._cachepath = self.builder._cachepath
@@ -54,7 +72,17 @@ class TestSnapBuildManagerIteration(TestCase):
         """Retrieve build manager's state."""
         return self.buildmanager._state
 
-    @defer.inlineCallbacks
+    def iterateSynchronously(self, retcode):
+        """Iterate the build manager through a state that runs no threads.
+
+        Only gathering the results of a build defers to a thread; every
+        other state fires its Deferred before `iterate` returns, so there
+        is no need to wait for the reactor.
+        """
+        self.assertThat(
+            self.buildmanager.iterate(retcode), succeeded(Is(None))
+        )
+
     def startBuild(self, args=None, options=None):
         # The build manager's iterate() kicks off the consecutive states
         # after INIT.
@@ -75,21 +103,14 @@ class TestSnapBuildManagerIteration(TestCase):
         self.buildmanager._state = SnapBuildState.UPDATE
 
         # BUILD_SNAP: Run the builder's payload to build the snap package.
-        yield self.buildmanager.iterate(0)
+        self.iterateSynchronously(0)
         self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "buildsnap",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        if options is not None:
-            expected_command.extend(options)
-        expected_command.append("test-snap")
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "buildsnap", self.buildid, [*(options or []), "test-snap"]
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -107,121 +128,24 @@ class TestSnapBuildManagerIteration(TestCase):
         self.assertEqual({"revision_id": "dummy"}, self.buildmanager.status())
 
     @defer.inlineCallbacks
-    def test_iterate(self):
-        # The build manager iterates a normal build from start to finish.
-        args = {
-            "build_request_id": 13,
-            "build_request_timestamp": "2018-04-13T14:50:02Z",
-            "build_url": "https://launchpad.example/build",
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-        }
-        expected_options = [
-            "--build-request-id",
-            "13",
-            "--build-request-timestamp",
-            "2018-04-13T14:50:02Z",
-            "--build-url",
-            "https://launchpad.example/build",
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+    def assertBuildCompletes(self, files, ignored_files=None):
+        """Reap a started build that produced `files`, then unmount.
 
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
+        :param files: A dict mapping paths in the build's backend to the
+            contents of the output files that the build produced.
+        :param ignored_files: A dict of other files left in the build's
+            backend, which should not be gathered.
+        """
+        self.builder.writeBuildLog(b"I am a build log.")
+        self.buildmanager.backend.add_files({**files, **(ignored_files or {})})
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
         self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                }
-            ),
-        )
-
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+            self.buildmanager.commands[-1],
+            CommandMatches("scan-for-processes", self.buildid),
         )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-
-    @defer.inlineCallbacks
-    def test_iterate_with_manifest(self):
-        # The build manager iterates a build that uploads a manifest from
-        # start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.manifest", b"I am a manifest."
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -230,491 +154,161 @@ class TestSnapBuildManagerIteration(TestCase):
             self.builder,
             HasWaitingFiles.byEquality(
                 {
-                    "test-snap_0_all.manifest": b"I am a manifest.",
-                    "test-snap_0_all.snap": b"I am a snap package.",
+                    os.path.basename(path): contents
+                    for path, contents in files.items()
                 }
             ),
         )
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-
-    @defer.inlineCallbacks
-    def test_iterate_with_components(self):
-        """Test building snap components
-
-        The build manager iterates a build that uploads components from
-        start to finish. We make sure that components exist and are correctly
-        added to the build results.
-        """
-
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap+somecomponent_0.comp",
-            b"I am a component.",
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
         self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap+somecomponent_0.comp": b"I am a component.",
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                }
-            ),
+            self.buildmanager.commands[-1],
+            CommandMatches("umount-chroot", self.buildid),
         )
-
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
         self.assertFalse(self.builder.wasCalled("buildFail"))
 
+    @run_with_reactor
     @defer.inlineCallbacks
-    def test_iterate_with_debug(self):
-        # The build manager iterates a build that uploads debug symbols from
+    def test_iterate(self):
+        # The build manager iterates a build with a build request from start to
+        # finish.
+        self.startBuild(
+            {
+                "build_request_id": 13,
+                "build_request_timestamp": "2018-04-13T14:50:02Z",
+                "build_url": "https://launchpad.example/build",
+                **GIT_ARGS,
+            },
+            [
+                "--build-request-id",
+                "13",
+                "--build-request-timestamp",
+                "2018-04-13T14:50:02Z",
+                "--build-url",
+                "https://launchpad.example/build",
+                *GIT_OPTIONS,
+            ],
+        )
+        yield self.assertBuildCompletes(SNAP_PACKAGE_FILE)
+
+    @run_with_reactor
+    @defer.inlineCallbacks
+    def test_iterate_with_manifest(self):
+        # The build manager iterates a build that produces a manifest from
         # start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.debug", b"I am debug symbols."
+        self.startBuild(GIT_ARGS, GIT_OPTIONS)
+        yield self.assertBuildCompletes(
+            {
+                **SNAP_PACKAGE_FILE,
+                "/build/test-snap/test-snap_0_all.manifest": (
+                    b"I am a manifest."
+                ),
+            }
         )
 
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.debug": b"I am debug symbols.",
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                }
-            ),
-        )
-
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-
+    @run_with_reactor
     @defer.inlineCallbacks
-    def test_iterate_with_dpkg_yaml(self):
-        # The build manager iterates a build that uploads dpkg.yaml from
+    def test_iterate_with_components(self):
+        # The build manager iterates a build that produces components from
         # start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.manifest", b"I am a manifest."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.dpkg.yaml", b"I am a yaml file."
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.manifest": b"I am a manifest.",
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                    "test-snap_0_all.dpkg.yaml": b"I am a yaml file.",
-                }
-            ),
-        )
-        # Ensure we don't just gather any yaml file but exactly
-        # the dpkg yaml.
-        self.assertNotEqual(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.manifest": b"I am a manifest.",
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                    "test-snap_0_all.snapcraft.yaml": b"I am a yaml file.",
-                }
-            ),
+        self.startBuild(GIT_ARGS, GIT_OPTIONS)
+        yield self.assertBuildCompletes(
+            {
+                **SNAP_PACKAGE_FILE,
+                "/build/test-snap/test-snap+somecomponent_0.comp": (
+                    b"I am a component."
+                ),
+            }
         )
 
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-
+    @run_with_reactor
     @defer.inlineCallbacks
-    def test_iterate_with_channels(self):
-        # The build manager iterates a build that specifies channels from
+    def test_iterate_with_debug(self):
+        # The build manager iterates a build that produces debug symbols from
         # start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-            "channels": {
-                "core": "candidate",
-                "core18": "beta",
-                "snapcraft": "edge",
-            },
-        }
-        expected_options = [
-            "--channel",
-            "core=candidate",
-            "--channel",
-            "core18=beta",
-            "--channel",
-            "snapcraft=edge",
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
+        self.startBuild(GIT_ARGS, GIT_OPTIONS)
+        yield self.assertBuildCompletes(
+            {
+                **SNAP_PACKAGE_FILE,
+                "/build/test-snap/test-snap_0_all.debug": (
+                    b"I am debug symbols."
+                ),
+            }
         )
 
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                }
-            ),
-        )
-
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-
+    @run_with_reactor
+    @defer.inlineCallbacks
+    def test_iterate_with_channels(self):
+        # The build manager iterates a build with channels from start to
+        # finish.
+        self.startBuild(
+            {**GIT_ARGS, "channels": dict(CHANNELS)},
+            [
+                *(
+                    option
+                    for name, channel in CHANNELS
+                    for option in ("--channel", f"{name}={channel}")
+                ),
+                *GIT_OPTIONS,
+            ],
+        )
+        yield self.assertBuildCompletes(SNAP_PACKAGE_FILE)
+
+    @run_with_reactor
     @defer.inlineCallbacks
     def test_iterate_with_build_source_tarball(self):
-        # The build manager iterates a build that uploads a source tarball
+        # The build manager iterates a build that produces a source tarball
         # from start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-            "build_source_tarball": True,
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-            "--build-source-tarball",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-        self.buildmanager.backend.add_file(
-            "/build/test-snap.tar.gz", b"I am a source tarball."
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                    "test-snap.tar.gz": b"I am a source tarball.",
-                }
-            ),
+        self.startBuild(
+            {**GIT_ARGS, "build_source_tarball": True},
+            [*GIT_OPTIONS, "--build-source-tarball"],
         )
-
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+        yield self.assertBuildCompletes(
+            {
+                **SNAP_PACKAGE_FILE,
+                "/build/test-snap.tar.gz": b"I am a source tarball.",
+            }
         )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
 
+    @run_with_reactor
     @defer.inlineCallbacks
     def test_iterate_private(self):
         # The build manager iterates a private build from start to finish.
-        args = {
-            "git_repository": "https://git.launchpad.dev/~example/+git/snap",
-            "git_path": "master",
-            "private": True,
-        }
-        expected_options = [
-            "--git-repository",
-            "https://git.launchpad.dev/~example/+git/snap",
-            "--git-path",
-            "master",
-            "--private",
-        ]
-        yield self.startBuild(args, expected_options)
-
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
-
-        self.buildmanager.backend.add_file(
-            "/build/test-snap/test-snap_0_all.snap", b"I am a snap package."
-        )
-
-        # After building the package, reap processes.
-        yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.BUILD_SNAP, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertNotEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
-        )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
-        self.assertThat(
-            self.builder,
-            HasWaitingFiles.byEquality(
-                {
-                    "test-snap_0_all.snap": b"I am a snap package.",
-                }
-            ),
+        self.startBuild(
+            {**GIT_ARGS, "private": True}, [*GIT_OPTIONS, "--private"]
         )
+        yield self.assertBuildCompletes(SNAP_PACKAGE_FILE)
 
-        # Control returns to the DebianBuildManager in the UMOUNT state.
-        self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=lxd",
-            "--series=xenial",
-            "--arch=i386",
-            self.buildid,
-        ]
-        self.assertEqual(SnapBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
-        self.assertEqual(
-            self.buildmanager.iterate, self.buildmanager.iterators[-1]
+    @run_with_reactor
+    @defer.inlineCallbacks
+    def test_iterate_with_dpkg_yaml(self):
+        # The build manager iterates a build that uploads dpkg.yaml from
+        # start to finish.
+        self.startBuild(GIT_ARGS, GIT_OPTIONS)
+        yield self.assertBuildCompletes(
+            {
+                **SNAP_PACKAGE_FILE,
+                "/build/test-snap/test-snap_0_all.manifest": (
+                    b"I am a manifest."
+                ),
+                "/build/test-snap/test-snap_0_all.dpkg.yaml": (
+                    b"I am a yaml file."
+                ),
+            },
+            # Ensure we don't just gather any yaml file but exactly the
+            # dpkg yaml.
+            ignored_files={
+                "/build/test-snap/test-snap_0_all.snapcraft.yaml": (
+                    b"I am a yaml file."
+                ),
+            },
         )
-        self.assertFalse(self.builder.wasCalled("buildFail"))
 
-    @defer.inlineCallbacks
     def test_iterate_snap_store_proxy(self):
         # The build manager can be told to use a snap store proxy.
         self.builder._config.set(
@@ -724,9 +318,8 @@ class TestSnapBuildManagerIteration(TestCase):
             "--snap-store-proxy-url",
             "http://snap-store-proxy.example/",
         ]
-        yield self.startBuild(options=expected_options)
+        self.startBuild(options=expected_options)
 
-    @defer.inlineCallbacks
     def test_iterate_target_architectures(self):
         args = {
             "build_request_id": 13,
@@ -752,9 +345,8 @@ class TestSnapBuildManagerIteration(TestCase):
             "--target-arch",
             "amd64",
         ]
-        yield self.startBuild(args, expected_options)
+        self.startBuild(args, expected_options)
 
-    @defer.inlineCallbacks
     def test_iterate_use_fetch_service(self):
         # The build manager can be told to use the fetch service as its proxy.
         # This requires also a ca certificate passed in via secrets.
@@ -767,9 +359,8 @@ class TestSnapBuildManagerIteration(TestCase):
             "--fetch-service-mitm-certificate",
             "content_of_cert",
         ]
-        yield self.startBuild(args, expected_options)
+        self.startBuild(args, expected_options)
 
-    @defer.inlineCallbacks
     def test_iterate_launchpad_url_and_instance(self):
         # The builder should be aware of the launchpad context.
         args = {
@@ -782,9 +373,8 @@ class TestSnapBuildManagerIteration(TestCase):
             "--launchpad-server-url",
             "launchpad.test",
         ]
-        yield self.startBuild(args, expected_options)
+        self.startBuild(args, expected_options)
 
-    @defer.inlineCallbacks
     def test_iterate_disable_proxy_after_pull(self):
         self.builder._config.set("builder", "proxyport", "8222")
         args = {
@@ -810,7 +400,7 @@ class TestSnapBuildManagerIteration(TestCase):
             "master",
         ]
         try:
-            yield self.startBuild(args, expected_options)
+            self.startBuild(args, expected_options)
         finally:
             self.buildmanager.stopProxy()
 
@@ -820,8 +410,10 @@ class TestSnapBuildManagerIteration(TestCase):
 
     def startFakeRemoteEndpoint(self):
         remote_endpoint = resource.Resource()
-        remote_endpoint.putChild(b"x", static.Data(b"x" * 1024, "text/plain"))
-        remote_endpoint.putChild(b"y", static.Data(b"y" * 65536, "text/plain"))
+        for name, payload in REMOTE_PAYLOADS.items():
+            remote_endpoint.putChild(
+                name.encode("UTF-8"), static.Data(payload, "text/plain")
+            )
         remote_endpoint_listener = reactor.listenTCP(
             0, server.Site(remote_endpoint)
         )
@@ -844,23 +436,19 @@ class TestSnapBuildManagerIteration(TestCase):
         return proxy_listener
 
     @defer.inlineCallbacks
-    def assertCommandSuccess(self, command, extra_env=None):
-        env = os.environ
-        if extra_env is not None:
-            env.update(extra_env)
-        out, err, code = yield utils.getProcessOutputAndValue(
-            command[0], command[1:], env=env, path="."
-        )
-        if code != 0:
-            self.addDetail(
-                "stdout", text_content(out.decode("UTF-8", "replace"))
-            )
-            self.addDetail(
-                "stderr", text_content(err.decode("UTF-8", "replace"))
+    def fetchViaProxy(self, proxy_listener, url):
+        """Fetch `url` through `proxy_listener`, returning the body."""
+        agent = ProxyAgent(
+            TCP4ClientEndpoint(
+                reactor, "localhost", proxy_listener.getHost().port
             )
-            self.assertEqual(0, code)
-        defer.returnValue(out)
+        )
+        response = yield agent.request(b"GET", url.encode("UTF-8"))
+        self.assertEqual(200, response.code)
+        body = yield readBody(response)
+        return body
 
+    @run_with_reactor
     @defer.inlineCallbacks
     def test_fetch_via_proxy(self):
         remote_endpoint_listener = self.startFakeRemoteEndpoint()
@@ -869,16 +457,15 @@ class TestSnapBuildManagerIteration(TestCase):
         proxy_listener = self.startLocalProxy(
             self.getListenerURL(remote_proxy_listener)
         )
-        out = yield self.assertCommandSuccess(
-            [b"curl", remote_endpoint_url.encode("UTF-8") + b"x"],
-            extra_env={"http_proxy": self.getListenerURL(proxy_listener)},
-        )
-        self.assertEqual(b"x" * 1024, out)
-        out = yield self.assertCommandSuccess(
-            [b"curl", remote_endpoint_url.encode("UTF-8") + b"y"],
-            extra_env={"http_proxy": self.getListenerURL(proxy_listener)},
+        # The fetches are independent, so make them concurrently.
+        outs = yield defer.gatherResults(
+            [
+                self.fetchViaProxy(proxy_listener, remote_endpoint_url + name)
+                for name in REMOTE_PAYLOADS
+            ],
+            consumeErrors=True,
         )
-        self.assertEqual(b"y" * 65536, out)
+        self.assertEqual(list(REMOTE_PAYLOADS.values()), outs)
 
     # XXX cjwatson 2017-04-13: We should really test the HTTPS case as well,
     # but it's hard to see how to test that in a way that's independent of
@@ -2,8 +2,6 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 import os
-import shutil
-import tempfile
 from textwrap import dedent
 
 from systemfixtures import FakeProcesses
@@ -11,49 +9,40 @@ from testtools import TestCase
 from testtools.twistedsupport import AsynchronousDeferredRunTest
 from twisted.internet import defer
 
+from lpbuildd.builder import get_build_path
 from lpbuildd.sourcepackagerecipe import (
     RETCODE_FAILURE_INSTALL_BUILD_DEPS,
     SourcePackageRecipeBuildManager,
     SourcePackageRecipeBuildState,
 )
-from lpbuildd.tests.fakebuilder import FakeBuilder
-from lpbuildd.tests.matchers import HasWaitingFiles
-
+from lpbuildd.tests.fakebuilder import (
+    RecordingBuildManagerMixin,
+    SharedFakeBuilderMixin,
+)
+from lpbuildd.tests.matchers import CommandMatches, HasWaitingFiles
 
-class MockBuildManager(SourcePackageRecipeBuildManager):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.commands = []
-        self.iterators = []
 
-    def runSubProcess(self, path, command, iterate=None):
-        self.commands.append([path] + command)
-        if iterate is None:
-            iterate = self.iterate
-        self.iterators.append(iterate)
-        return 0
+class MockBuildManager(
+    RecordingBuildManagerMixin, SourcePackageRecipeBuildManager
+):
+    pass
 
 
-class TestSourcePackageRecipeBuildManagerIteration(TestCase):
+class TestSourcePackageRecipeBuildManagerIteration(
+    SharedFakeBuilderMixin, TestCase
+):
     """Run SourcePackageRecipeBuildManager through its iteration steps."""
 
     run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=5)
 
     def setUp(self):
         super().setUp()
-        self.working_dir = tempfile.mkdtemp()
-        self.addCleanup(lambda: shutil.rmtree(self.working_dir))
-        builder_dir = os.path.join(self.working_dir, "builder")
-        home_dir = os.path.join(self.working_dir, "home")
-        for dir in (builder_dir, home_dir):
-            os.mkdir(dir)
-        self.builder = FakeBuilder(builder_dir)
         self.buildid = "123"
         self.buildmanager = MockBuildManager(self.builder, self.buildid)
-        self.buildmanager.home = home_dir
+        self.buildmanager.home = self.home_dir
         self.buildmanager._cachepath = self.builder._cachepath
         self.chrootdir = os.path.join(
-            home_dir, "build-%s" % self.buildid, "chroot-autobuild"
+            self.home_dir, "build-%s" % self.buildid, "chroot-autobuild"
         )
 
     def getState(self):
@@ -143,39 +132,28 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
         # The build manager iterates a normal build from start to finish.
         yield self.startBuild()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a build log.")
+        self.builder.writeBuildLog(b"I am a build log.")
 
-        changes_path = os.path.join(
-            self.buildmanager.home,
-            "build-%s" % self.buildid,
-            "foo_1_source.changes",
-        )
-        with open(changes_path, "w") as changes:
-            changes.write("I am a changes file.")
-
-        manifest_path = os.path.join(
-            self.buildmanager.home, "build-%s" % self.buildid, "manifest"
-        )
-        with open(manifest_path, "w") as manifest:
+        build_dir = get_build_path(self.buildmanager.home, self.buildid)
+        with open(os.path.join(build_dir, "foo_1_source.changes"), "w") as f:
+            f.write("I am a changes file.")
+        with open(os.path.join(build_dir, "manifest"), "w") as manifest:
             manifest.write("I am a manifest file.")
 
         # After building the package, reap processes.
         yield self.buildmanager.iterate(0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(
             SourcePackageRecipeBuildState.BUILD_RECIPE, self.getState()
         )
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "scan-for-processes",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -192,17 +170,16 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(SourcePackageRecipeBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "umount-chroot",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -213,30 +190,27 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
         # The build manager can detect dependency wait states.
         yield self.startBuild()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write(
-                "The following packages have unmet dependencies:\n"
-                " pbuilder-satisfydepends-dummy :"
-                " Depends: base-files (>= 1000)"
-                " but it is not going to be installed.\n"
-            )
+        self.builder.writeBuildLog(
+            b"The following packages have unmet dependencies:\n"
+            b" pbuilder-satisfydepends-dummy :"
+            b" Depends: base-files (>= 1000)"
+            b" but it is not going to be installed.\n"
+        )
 
         # The buildmanager calls depFail correctly and reaps processes.
         yield self.buildmanager.iterate(RETCODE_FAILURE_INSTALL_BUILD_DEPS)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(
             SourcePackageRecipeBuildState.BUILD_RECIPE, self.getState()
         )
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "scan-for-processes",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -247,17 +221,16 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(SourcePackageRecipeBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "umount-chroot",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -269,25 +242,22 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
         # build-dependency installation failure, it fails the build.
         yield self.startBuild()
 
-        log_path = os.path.join(self.buildmanager._cachepath, "buildlog")
-        with open(log_path, "w") as log:
-            log.write("I am a failing build log.")
+        self.builder.writeBuildLog(b"I am a failing build log.")
 
         # The buildmanager calls buildFail correctly and reaps processes.
         yield self.buildmanager.iterate(RETCODE_FAILURE_INSTALL_BUILD_DEPS)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "scan-for-processes",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(
             SourcePackageRecipeBuildState.BUILD_RECIPE, self.getState()
         )
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "scan-for-processes",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertNotEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
@@ -296,17 +266,16 @@ class TestSourcePackageRecipeBuildManagerIteration(TestCase):
 
         # Control returns to the DebianBuildManager in the UMOUNT state.
         self.buildmanager.iterateReap(self.getState(), 0)
-        expected_command = [
-            "sharepath/bin/in-target",
-            "in-target",
-            "umount-chroot",
-            "--backend=chroot",
-            "--series=maverick",
-            "--arch=i386",
-            self.buildid,
-        ]
         self.assertEqual(SourcePackageRecipeBuildState.UMOUNT, self.getState())
-        self.assertEqual(expected_command, self.buildmanager.commands[-1])
+        self.assertThat(
+            self.buildmanager.commands[-1],
+            CommandMatches(
+                "umount-chroot",
+                self.buildid,
+                backend="chroot",
+                series="maverick",
+            ),
+        )
         self.assertEqual(
             self.buildmanager.iterate, self.buildmanager.iterators[-1]
         )
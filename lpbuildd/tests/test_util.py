@@ -2,9 +2,12 @@
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
 import base64
+import io
 import json
 
 import responses
+from fixtures import EnvironmentVariable
+from systemfixtures import FakeProcesses
 from testtools import TestCase
 
 from lpbuildd.util import (
@@ -45,6 +48,17 @@ class TestGetArchBits(TestCase):
         self.assertEqual(64, get_arch_bits("amd64"))
         self.assertEqual(64, get_arch_bits("arm64"))
 
+    def test_ignores_environment_override(self):
+        # An inherited DEB_HOST_ARCH_BITS is hidden from dpkg-architecture.
+        self.useFixture(EnvironmentVariable("DEB_HOST_ARCH_BITS", "64"))
+        processes_fixture = self.useFixture(FakeProcesses())
+        processes_fixture.add(
+            lambda _: {"stdout": io.StringIO("32\n")}, name="dpkg-architecture"
+        )
+        self.assertEqual(32, get_arch_bits("armhf"))
+        [proc] = processes_fixture.procs
+        self.assertNotIn("DEB_HOST_ARCH_BITS", proc._args["env"])
+
 
 class TestSetPersonality(TestCase):
     def test_32bit(self):
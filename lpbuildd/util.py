@@ -10,6 +10,11 @@ from urllib.parse import urlparse
 
 import requests
 
+# Series whose commands are run with "setarch --uname-2.6".
+UNAME_2_6_SERIES = frozenset(
+    {"hardy", "lucid", "maverick", "natty", "oneiric", "precise"}
+)
+
 
 def shell_escape(s):
     # It's sometimes necessary to pass arguments as bytes to avoid
@@ -27,8 +32,12 @@ def get_arch_bits(arch):
         # running on a 64-bit kernel.
         return 64
     else:
-        env = dict(os.environ)
-        env.pop("DEB_HOST_ARCH_BITS", None)
+        # Only copy the environment if we need to hide an override from
+        # dpkg-architecture; otherwise let the child inherit ours.
+        env = None
+        if "DEB_HOST_ARCH_BITS" in os.environ:
+            env = dict(os.environ)
+            del env["DEB_HOST_ARCH_BITS"]
         bits = subprocess.check_output(
             ["dpkg-architecture", "-a%s" % arch, "-qDEB_HOST_ARCH_BITS"],
             env=env,
@@ -53,7 +62,7 @@ def set_personality(args, arch, series=None):
     else:
         setarch_cmd = ["linux64"]
 
-    if series in ("hardy", "lucid", "maverick", "natty", "oneiric", "precise"):
+    if series in UNAME_2_6_SERIES:
         setarch_cmd.append("--uname-2.6")
 
     return setarch_cmd + args
@@ -69,8 +78,18 @@ class RevokeProxyTokenError(Exception):
         return f"Unable to revoke token for {self.username}: {self.exception}"
 
 
+def get_proxy_auth_header(proxy_url):
+    """Return a Basic `Authorization` header value for a proxy URL.
+
+    The credentials are the username and password embedded in the URL.
+    """
+    url = urlparse(proxy_url)
+    auth_string = f"{url.username}:{url.password}"
+    return "Basic " + base64.b64encode(auth_string.encode()).decode()
+
+
 def revoke_proxy_token(
-    proxy_url, revocation_endpoint, use_fetch_service=False
+    proxy_url, revocation_endpoint, use_fetch_service=False, auth_header=None
 ):
     """Revoke builder proxy token.
 
@@ -88,6 +107,8 @@ def revoke_proxy_token(
         We use the token from the proxy_url and send it as a json payload (no
         authentication required).
 
+    :param auth_header: The result of `get_proxy_auth_header(proxy_url)`,
+        if the caller has already computed it.
     :raises RevokeProxyTokenError: if attempting to revoke the token failed.
     """
     url = urlparse(proxy_url)
@@ -96,9 +117,9 @@ def revoke_proxy_token(
     json_data = None
 
     if not use_fetch_service:
-        auth_string = f"{url.username}:{url.password}"
-        token = base64.b64encode(auth_string.encode()).decode()
-        headers = {"Authorization": f"Basic {token}"}
+        if auth_header is None:
+            auth_header = get_proxy_auth_header(proxy_url)
+        headers = {"Authorization": auth_header}
     else:
         # When using the fetch service, we don't require authentication, but we
         # need to send the token we want to revoke in the payload.